@@ -3,8 +3,79 @@
 Interactive utility to generate terraform.tfvars files for BigQuery dataset configuration.
 """
 
+import functools
+import io
 import sys
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+
+class FilterCol(NamedTuple):
+    """A single filter column applied to a source table view."""
+    column_name: str
+    condition: str
+    operator: str = "AND"
+
+
+# Predefined table-to-filter mappings (sample)
+_TABLE_FILTERS: Dict[str, Tuple[str, ...]] = {
+    "users": ("account_name", "user_id", "status"),
+    "transactions": ("client_id", "status", "region"),
+    "events": ("account_name", "user_id"),
+    "orders": ("client_id", "status"),
+    "logs": ("account_name", "region")
+}
+
+# Predefined source datasets and tables structure
+_PREDEFINED_STRUCTURE: Dict[str, Dict[str, Any]] = {
+    "raw_lake": {
+        "description": "Raw data lake",
+        "tables": ("users", "transactions", "events", "orders", "logs")
+    },
+    "analytics_raw": {
+        "description": "Raw analytics data",
+        "tables": ("user_behavior", "conversion_events", "page_tracking")
+    },
+    "transaction_raw": {
+        "description": "Raw transaction data",
+        "tables": ("payments", "refunds", "invoices")
+    }
+}
+
+# Predefined global filter columns and their input prompts
+_FILTER_COLUMNS_PROMPTS: Tuple[Tuple[str, str], ...] = tuple(
+    (column, f"{column} ({description}) - comma separated for multiple")
+    for column, description in (
+        ("account_name", "Account name filter"),
+        ("client_id", "Client ID filter"),
+        ("user_id", "User ID filter"),
+        ("status", "Status filter (e.g., 'active', 'completed')"),
+        ("region", "Region filter")
+    )
+)
+
+# Accepted answers for yes/no prompts
+_YES_NO: Dict[str, bool] = {"y": True, "yes": True, "n": False, "no": False}
+
+# Characters replaced when turning a client name into a dataset key
+_SLUG_TABLE = str.maketrans({" ": "_", "-": "_"})
+
+
+def _slugify(name: str) -> str:
+    """Lowercase a name and replace spaces and hyphens with underscores."""
+    return name.lower().translate(_SLUG_TABLE)
+
+
+def _read_line(prompt: str) -> str:
+    """Read a line of input, bypassing input() when stdin is not a TTY."""
+    if sys.stdin.isatty():
+        return input(prompt)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        # Match input() behaviour on end of input
+        raise EOFError("EOF when reading a line")
+    return line.rstrip("\n")
 
 
 def get_input(prompt: str, required: bool = True, default: Optional[str] = None) -> str:
@@ -15,7 +86,7 @@ def get_input(prompt: str, required: bool = True, default: Optional[str] = None)
         prompt = f"{prompt}: "
     
     while True:
-        value = input(prompt).strip()
+        value = _read_line(prompt).strip()
         if value:
             return value
         elif default:
@@ -30,82 +101,75 @@ def get_yes_no(prompt: str, default: bool = False) -> bool:
     """Get yes/no input from user."""
     default_str = "Y/n" if default else "y/N"
     while True:
-        response = input(f"{prompt} ({default_str}): ").strip().lower()
-        if response in ['y', 'yes']:
-            return True
-        elif response in ['n', 'no']:
-            return False
-        elif not response:
+        response = _read_line(f"{prompt} ({default_str}): ").strip().lower()
+        if not response:
             return default
-        else:
-            print("Please enter 'y' or 'n'.")
+        result = _YES_NO.get(response)
+        if result is not None:
+            return result
+        print("Please enter 'y' or 'n'.")
+
+
+def _format_filter_condition(values: List[str]) -> str:
+    """Render the SQL condition for a list of filter values."""
+    if len(values) == 1:
+        return f"= '{values[0]}'"
+    # Multiple values - use IN clause
+    formatted_values = "', '".join(values)
+    return f"IN ('{formatted_values}')"
+
 
+def collect_global_filter_values() -> Dict[str, str]:
+    """Collect global filter values that will be applied across tables.
 
-def collect_global_filter_values() -> Dict[str, List[str]]:
-    """Collect global filter values that will be applied across tables."""
-    filter_values = {}
+    Returns the SQL condition rendered for each column that has at least
+    one value.
+    """
+    filter_conditions = {}
     
     print("\n=== Global Filter Values ===")
     print("These values will be used for filtering across all applicable tables.")
     print("You can specify multiple values separated by commas.")
     print("Leave empty if not needed.\n")
     
-    # Define predefined filter columns
-    filter_columns = {
-        "account_name": "Account name filter",
-        "client_id": "Client ID filter", 
-        "user_id": "User ID filter",
-        "status": "Status filter (e.g., 'active', 'completed')",
-        "region": "Region filter"
-    }
-    
-    for column, description in filter_columns.items():
-        value = get_input(f"{column} ({description}) - comma separated for multiple", required=False)
+    for column, prompt in _FILTER_COLUMNS_PROMPTS:
+        value = get_input(prompt, required=False)
         if value:
             # Split by comma and strip whitespace
             values = [v.strip() for v in value.split(',') if v.strip()]
-            filter_values[column] = values
+            if values:
+                filter_conditions[column] = _format_filter_condition(values)
     
-    return filter_values
+    return filter_conditions
+
+
+GlobalFiltersKey = Tuple[Tuple[str, str], ...]
+
 
+def make_global_filters_key(global_filter_conditions: Dict[str, str]) -> GlobalFiltersKey:
+    """Convert global filter conditions into a hashable key for get_table_filter_columns."""
+    return tuple(sorted(global_filter_conditions.items()))
 
-def get_table_filter_columns(table_name: str, global_filters: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+
+@functools.lru_cache(maxsize=None)
+def get_table_filter_columns(table_name: str, global_filters_key: GlobalFiltersKey) -> Tuple[FilterCol, ...]:
     """Generate filter columns for a table based on predefined mappings."""
-    
-    # Predefined table-to-filter mappings (sample)
-    table_filters = {
-        "users": ["account_name", "user_id", "status"],
-        "transactions": ["client_id", "status", "region"],
-        "events": ["account_name", "user_id"],
-        "orders": ["client_id", "status"],
-        "logs": ["account_name", "region"]
-    }
-    
+    global_filter_conditions = dict(global_filters_key)
     filter_columns = []
-    applicable_filters = table_filters.get(table_name, [])
+    applicable_filters = _TABLE_FILTERS.get(table_name, ())
     
     for column_name in applicable_filters:
-        if column_name in global_filters and global_filters[column_name]:
-            values = global_filters[column_name]
-            if len(values) == 1:
-                condition = f"= '{values[0]}'"
-            else:
-                # Multiple values - use IN clause
-                formatted_values = "', '".join(values)
-                condition = f"IN ('{formatted_values}')"
-            
-            filter_columns.append({
-                "column_name": column_name,
-                "condition": condition,
-                "operator": "AND"
-            })
+        condition = global_filter_conditions.get(column_name)
+        if condition:
+            filter_columns.append(FilterCol(column_name, condition))
     
-    return filter_columns
+    return tuple(filter_columns)
 
 
-def collect_table_info(global_filters: Dict[str, List[str]]) -> Dict[str, Any]:
+def collect_table_info(global_filter_conditions: Dict[str, str]) -> Dict[str, Any]:
     """Collect information for a single table."""
     table_info = {}
+    interactive = sys.stdout.isatty()
     
     print("\n--- Table Configuration ---")
     table_info['source_table_id'] = get_input("Source table ID")
@@ -113,12 +177,16 @@ def collect_table_info(global_filters: Dict[str, List[str]]) -> Dict[str, Any]:
     table_info['description'] = get_input("Description", required=False)
     
     # Generate filter columns based on table name and global filters
-    filter_columns = get_table_filter_columns(table_info['source_table_id'], global_filters)
+    filter_columns = list(get_table_filter_columns(table_info['source_table_id'],
+                                                   make_global_filters_key(global_filter_conditions)))
     
-    if filter_columns:
+    # Only list each filter when someone is watching the terminal
+    if interactive and filter_columns:
         print(f"\nApplied filters for '{table_info['source_table_id']}':")
         for filter_col in filter_columns:
-            print(f"  - {filter_col['column_name']} {filter_col['condition']}")
+            print(f"  - {filter_col.column_name} {filter_col.condition}")
+    elif filter_columns:
+        print(f"\nApplied {len(filter_columns)} filters for '{table_info['source_table_id']}'")
     else:
         print(f"\nNo applicable filters for '{table_info['source_table_id']}'")
     
@@ -128,28 +196,32 @@ def collect_table_info(global_filters: Dict[str, List[str]]) -> Dict[str, Any]:
     return table_info
 
 
-def generate_source_datasets_config(global_filters: Dict[str, List[str]], client_key: str) -> Dict[str, Any]:
+def generate_source_datasets_config(global_filter_conditions: Dict[str, str], client_key: str) -> Dict[str, Any]:
     """Generate source datasets configuration from predefined structure."""
+    source_datasets_config = {}
     
-    # Predefined source datasets and tables structure
-    predefined_structure = {
-        "raw_lake": {
-            "description": "Raw data lake",
-            "tables": ["users", "transactions", "events", "orders", "logs"]
-        },
-        "analytics_raw": {
-            "description": "Raw analytics data",
-            "tables": ["user_behavior", "conversion_events", "page_tracking"]
-        },
-        "transaction_raw": {
-            "description": "Raw transaction data",
-            "tables": ["payments", "refunds", "invoices"]
-        }
-    }
+    # Without any global filters no table gets filter columns
+    if not global_filter_conditions:
+        for dataset_name, config in _PREDEFINED_STRUCTURE.items():
+            source_datasets_config[dataset_name] = {
+                "target_dataset_key": client_key,
+                "description": config["description"],
+                "tables": {
+                    table_name: {
+                        "source_table_id": table_name,
+                        "view_name": table_name,
+                        "filter_columns": [],
+                        "additional_where": "",
+                        "description": f"{table_name} filtered view"
+                    }
+                    for table_name in config["tables"]
+                }
+            }
+        return source_datasets_config
     
-    source_datasets_config = {}
+    gf_key = make_global_filters_key(global_filter_conditions)
     
-    for dataset_name, config in predefined_structure.items():
+    for dataset_name, config in _PREDEFINED_STRUCTURE.items():
         dataset_config = {
             "target_dataset_key": client_key,
             "description": config["description"],
@@ -158,7 +230,7 @@ def generate_source_datasets_config(global_filters: Dict[str, List[str]], client
         
         # Generate tables for this dataset
         for table_name in config["tables"]:
-            filter_columns = get_table_filter_columns(table_name, global_filters)
+            filter_columns = list(get_table_filter_columns(table_name, gf_key))
             
             dataset_config["tables"][table_name] = {
                 "source_table_id": table_name,
@@ -173,101 +245,186 @@ def generate_source_datasets_config(global_filters: Dict[str, List[str]], client
     return source_datasets_config
 
 
-def generate_tfvars_content(config: Dict[str, Any]) -> str:
-    """Generate terraform.tfvars content from configuration."""
-    lines = [
-        "# GCP Configuration",
-        f'project_id = "{config["project_id"]}"',
-        f'region     = "{config.get("region", "asia-northeast1")}"',
-        "",
-        "# View Configuration", 
-        f'view_prefix = "{config.get("view_prefix", "filtered_")}"',
-        "",
-        "# Output Datasets Configuration",
-        "output_datasets_config = {"
-    ]
+def _render_filter(filter_col: FilterCol) -> str:
+    """Render a single filter column entry of a table's filter_columns list."""
+    operator = (f'            operator    = "{op}"\n'
+                if (op := filter_col.operator) != "AND" else "")
+    return ("          {\n"
+            f'            column_name = "{filter_col.column_name}"\n'
+            f'            condition   = "{filter_col.condition}"\n'
+            f"{operator}"
+            "          }\n")
+
+
+def _render_source_dataset(dataset_name: str, dataset_info: Dict[str, Any]) -> str:
+    """Render one entry of source_datasets_config including its tables."""
+    buf = io.StringIO()
+    w = buf.write
+    
+    w(f'  "{dataset_name}" = {{\n'
+      f'    target_dataset_key = "{dataset_info["target_dataset_key"]}"\n')
+    
+    if "source_project_id" in dataset_info:
+        w(f'    source_project_id  = "{dataset_info["source_project_id"]}"\n')
+    
+    w(f'    description        = "{dataset_info["description"]}"\n'
+      "    tables = {\n")
+    
+    # Tables
+    for table_key, table_info in dataset_info["tables"].items():
+        filter_block = "".join(_render_filter(f) for f in table_info["filter_columns"])
+        aw = table_info.get("additional_where")
+        desc = table_info.get("description")
+        additional_where_line = f'        additional_where = "{aw}"\n' if aw else ""
+        description_line = f'        description     = "{desc}"\n' if desc else ""
+        w(f'      "{table_key}" = {{\n'
+          f'        source_table_id = "{table_info["source_table_id"]}"\n'
+          f'        view_name      = "{table_info["view_name"]}"\n'
+          "        filter_columns = [\n"
+          f"{filter_block}"
+          "        ]\n"
+          f"{additional_where_line}"
+          f"{description_line}"
+          "      }\n"
+          "\n")
+    
+    w("    }\n"
+      "  }\n"
+      "\n")
+    
+    return buf.getvalue()
+
+
+def _build_source_template() -> str:
+    """Render the predefined source datasets as a str.format template.
+
+    Only the target dataset key and the filter block of each table depend
+    on user input; they are left as {client_key} and {<table>_filters} fields.
+    Literal braces are doubled for str.format, hence {{{{ in the f-strings.
+    """
+    parts = []
+    for dataset_name, config in _PREDEFINED_STRUCTURE.items():
+        parts.append(f'  "{dataset_name}" = {{{{\n'
+                     '    target_dataset_key = "{client_key}"\n'
+                     f'    description        = "{config["description"]}"\n'
+                     "    tables = {{\n")
+        
+        for table_name in config["tables"]:
+            if not table_name.isidentifier():
+                raise ValueError(f"Table name {table_name!r} cannot be used as a template field")
+            parts.append(f'      "{table_name}" = {{{{\n'
+                         f'        source_table_id = "{table_name}"\n'
+                         f'        view_name      = "{table_name}"\n'
+                         "        filter_columns = [\n"
+                         f"{{{table_name}_filters}}"
+                         "        ]\n"
+                         f'        description     = "{table_name} filtered view"\n'
+                         "      }}\n"
+                         "\n")
+        
+        parts.append("    }}\n"
+                     "  }}\n"
+                     "\n")
+    
+    return "".join(parts)
+
+
+_SOURCE_TEMPLATE = _build_source_template()
+
+
+def _render_predefined_source_datasets(global_filter_conditions: Dict[str, str], client_key: str) -> str:
+    """Render the predefined source datasets for the given filters and client key.
+
+    Produces the same text as rendering generate_source_datasets_config()
+    with _render_source_dataset, but only formats the per-table filter
+    blocks at runtime.
+    """
+    source_datasets_config = generate_source_datasets_config(global_filter_conditions, client_key)
+    filter_blocks = {
+        f"{table_name}_filters": "".join(_render_filter(f) for f in table_info["filter_columns"])
+        for dataset_info in source_datasets_config.values()
+        for table_name, table_info in dataset_info["tables"].items()
+    }
+    return _SOURCE_TEMPLATE.format(client_key=client_key, **filter_blocks)
+
+
+def _verify_source_template() -> None:
+    """Check that _SOURCE_TEMPLATE matches the generic renderer."""
+    # Give every filter column a value so each table renders a filter block
+    sample_conditions = {column: "= 'x'" for column, _ in _FILTER_COLUMNS_PROMPTS}
+    for conditions in ({}, sample_conditions):
+        expected = "".join(
+            _render_source_dataset(dataset_name, dataset_info)
+            for dataset_name, dataset_info in generate_source_datasets_config(conditions, "key").items()
+        )
+        if _render_predefined_source_datasets(conditions, "key") != expected:
+            raise RuntimeError("_SOURCE_TEMPLATE does not match the generic source datasets renderer")
+
+
+_verify_source_template()
+
+
+def generate_tfvars_content(config: Dict[str, Any], rendered_source_datasets: Optional[str] = None) -> str:
+    """Generate terraform.tfvars content from configuration.
+
+    If rendered_source_datasets is given (see _render_predefined_source_datasets),
+    it is written in place of rendering config["source_datasets_config"].
+    """
+    buf = io.StringIO()
+    w = buf.write
+    
+    w("# GCP Configuration\n"
+      f'project_id = "{config["project_id"]}"\n'
+      f'region     = "{config.get("region", "asia-northeast1")}"\n'
+      "\n"
+      "# View Configuration\n"
+      f'view_prefix = "{config.get("view_prefix", "filtered_")}"\n'
+      "\n"
+      "# Output Datasets Configuration\n"
+      "output_datasets_config = {\n")
     
     # Output datasets
     for key, dataset in config["output_datasets_config"].items():
-        lines.extend([
-            f'  "{key}" = {{',
-            f'    dataset_id  = "{dataset["dataset_id"]}"',
-            f'    description = "{dataset["description"]}"',
-            f'    months_back = {dataset["months_back"]}',
-            "    labels = {"
-        ])
-        
-        for label_key, label_value in dataset["labels"].items():
-            lines.append(f'      {label_key} = "{label_value}"')
-        
-        lines.extend([
-            "    }",
-            "  }",
-            ""
-        ])
-    
-    lines.extend([
-        "}",
-        "",
-        "# Source Datasets and Tables Configuration",
-        "source_datasets_config = {"
-    ])
+        labels_block = "".join(f'      {k} = "{v}"\n' for k, v in dataset["labels"].items())
+        w(f'  "{key}" = {{\n'
+          f'    dataset_id  = "{dataset["dataset_id"]}"\n'
+          f'    description = "{dataset["description"]}"\n'
+          f'    months_back = {dataset["months_back"]}\n'
+          "    labels = {\n"
+          f"{labels_block}"
+          "    }\n"
+          "  }\n"
+          "\n")
+    
+    w("}\n"
+      "\n"
+      "# Source Datasets and Tables Configuration\n"
+      "source_datasets_config = {\n")
     
     # Source datasets
-    for dataset_name, dataset_info in config["source_datasets_config"].items():
-        lines.append(f'  "{dataset_name}" = {{')
-        lines.append(f'    target_dataset_key = "{dataset_info["target_dataset_key"]}"')
-        
-        if "source_project_id" in dataset_info:
-            lines.append(f'    source_project_id  = "{dataset_info["source_project_id"]}"')
-        
-        lines.extend([
-            f'    description        = "{dataset_info["description"]}"',
-            "    tables = {"
-        ])
-        
-        # Tables
-        for table_key, table_info in dataset_info["tables"].items():
-            lines.extend([
-                f'      "{table_key}" = {{',
-                f'        source_table_id = "{table_info["source_table_id"]}"',
-                f'        view_name      = "{table_info["view_name"]}"',
-                "        filter_columns = ["
-            ])
-            
-            # Filter columns
-            for filter_col in table_info["filter_columns"]:
-                lines.extend([
-                    "          {",
-                    f'            column_name = "{filter_col["column_name"]}"',
-                    f'            condition   = "{filter_col["condition"]}"'
-                ])
-                if filter_col.get("operator") != "AND":
-                    lines.append(f'            operator    = "{filter_col["operator"]}"')
-                lines.append("          }")
-            
-            lines.append("        ]")
-            
-            if table_info.get("additional_where"):
-                lines.append(f'        additional_where = "{table_info["additional_where"]}"')
-            
-            if table_info.get("description"):
-                lines.append(f'        description     = "{table_info["description"]}"')
-            
-            lines.extend([
-                "      }",
-                ""
-            ])
-        
-        lines.extend([
-            "    }",
-            "  }",
-            ""
-        ])
+    if rendered_source_datasets is not None:
+        w(rendered_source_datasets)
+    else:
+        for dataset_name, dataset_info in config["source_datasets_config"].items():
+            w(_render_source_dataset(dataset_name, dataset_info))
     
-    lines.append("}")
+    w("}")
     
-    return "\n".join(lines)
+    return buf.getvalue()
+
+
+def _build_output_dataset(dataset_key: str, client_name: str, client_label: str, months_back: int) -> Dict[str, Any]:
+    """Build the output dataset configuration for a dataset key."""
+    return {
+        "dataset_id": f"{dataset_key}_filtered",
+        "description": f"{dataset_key.title()} filtered views for {client_name}",
+        "months_back": months_back,
+        "labels": {
+            "environment": "production",
+            "client": client_label,
+            "team": dataset_key
+        }
+    }
 
 
 def main():
@@ -281,9 +438,11 @@ def main():
     
     # Client name for labeling
     client_name = get_input("Client name")
+    # Label value only replaces spaces; unlike _slugify, hyphens are kept
+    client_label = client_name.lower().replace(" ", "_")
     
     # Collect global filter values first
-    global_filters = collect_global_filter_values()
+    global_filter_conditions = collect_global_filter_values()
     
     # Output datasets configuration
     output_datasets_config = {}
@@ -292,53 +451,35 @@ def main():
     print(f"Using client name '{client_name}' as dataset key")
     
     # Use client_name as the default dataset key
-    client_key = client_name.lower().replace(" ", "_").replace("-", "_")
+    client_key = _slugify(client_name)
     dataset_key = get_input("Dataset key", default=client_key)
     months_back = int(get_input("Months back", default="18"))
     
-    output_datasets_config[dataset_key] = {
-        "dataset_id": f"{dataset_key}_filtered",
-        "description": f"{dataset_key.title()} filtered views for {client_name}",
-        "months_back": months_back,
-        "labels": {
-            "environment": "production",
-            "client": client_name.lower().replace(" ", "_"),
-            "team": dataset_key
-        }
-    }
+    output_datasets_config[dataset_key] = _build_output_dataset(dataset_key, client_name, client_label, months_back)
     
     # Ask if they want additional output datasets
     while get_yes_no("Add another output dataset?", default=False):
         dataset_key = get_input("Dataset key (e.g., 'analytics', 'finance')")
         months_back = int(get_input("Months back", default="18"))
         
-        output_datasets_config[dataset_key] = {
-            "dataset_id": f"{dataset_key}_filtered",
-            "description": f"{dataset_key.title()} filtered views for {client_name}",
-            "months_back": months_back,
-            "labels": {
-                "environment": "production",
-                "client": client_name.lower().replace(" ", "_"),
-                "team": dataset_key
-            }
-        }
+        output_datasets_config[dataset_key] = _build_output_dataset(dataset_key, client_name, client_label, months_back)
     
     config["output_datasets_config"] = output_datasets_config
     
     # Generate source datasets configuration automatically
     print("\n=== Generating Source Datasets Configuration ===")
     print("Using predefined datasets and tables structure...")
-    source_datasets_config = generate_source_datasets_config(global_filters, client_key)
-    config["source_datasets_config"] = source_datasets_config
+    source_datasets = _render_predefined_source_datasets(global_filter_conditions, client_key)
     
     # Generate and save
-    content = generate_tfvars_content(config)
+    content = generate_tfvars_content(config, source_datasets)
     
     output_file = get_input("Output filename", default="terraform.tfvars")
     
     try:
-        with open(output_file, 'w') as f:
-            f.write(content)
+        data = content.encode("utf-8")
+        with open(output_file, 'wb') as f:
+            f.write(data)
         print(f"\n✅ Generated {output_file} successfully!")
     except Exception as e:
         print(f"❌ Error writing file: {e}", file=sys.stderr)